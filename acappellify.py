@@ -242,7 +242,6 @@ def to_many_monophonic(poly_midi: PrettyMIDI) -> list[PrettyMIDI]:
   -H "X-GitHub-Api-Version: 2022-11-28" \
   https://github.com/MoonInTheRiver/DiffSinger/releases/download/pretrain-model/model_ckpt_steps_1512000.ckpt
 
-from datetime import datetime
 import math
 import re
 import tempfile
@@ -275,7 +274,16 @@ class DiffSinger:
         self.sample_rate = hparams["audio_sample_rate"]
 
     def vocalize(self, mono_midi: PrettyMIDI) -> AudioSegment:
-        ds_batches_and_offsets = self._mono_midi_to_ds_batches(mono_midi)
+        return self.vocalize_ds_batches(*self.get_ds_batches(mono_midi))
+
+    def get_ds_batches(self, mono_midi: PrettyMIDI) -> tuple[list[tuple[dict[str, str], float]], float]:
+        return self._mono_midi_to_ds_batches(mono_midi), mono_midi.instruments[0].notes[-1].end
+
+    def vocalize_ds_batches(
+        self,
+        ds_batches_and_offsets: list[tuple[dict[str, str], float]],
+        end_s: float,
+    ) -> AudioSegment:
         ds_batches = [ds_batch for ds_batch, _ in ds_batches_and_offsets]
         offsets = [offset for _, offset in ds_batches_and_offsets]
 
@@ -288,10 +296,9 @@ class DiffSinger:
                 vocal_segment = AudioSegment.from_wav(tmp_f.name)
                 vocal_segments.append(vocal_segment)
 
-        midi_end_s = mono_midi.instruments[0].notes[-1].end
         durations_ms = [round((next - current) * 1000)
                         for current, next in zip([0.0] + offsets,
-                                                 offsets + [midi_end_s],
+                                                 offsets + [end_s],
                                                  strict=True)]
 
         vocal = AudioSegment.silent(durations_ms[0], self.sample_rate)
@@ -389,6 +396,171 @@ class DiffSinger:
             "is_slur_seq": " ".join("0" * len(notes)),
         }
 
+"""# Intermediate format"""
+
+!pip install -q numpy pretty_midi
+
+import os
+from pathlib import Path
+import shutil
+from typing import Union
+import uuid
+
+import numpy as np
+from pretty_midi import Note, PrettyMIDI
+
+
+# Every intermediate is a directory with one .npy file per column, so that `load_columns` just memory-maps the
+# files, e.g. for computing statistics without building any objects. The typed loaders below build the pipeline's
+# objects from the columns, only reading the slices of the groups they need.
+# Variable-length groups (notes of a voice, voices of an octave, phonemes of a phrase batch) are stored flattened,
+# with `*_splits` holding the offsets at which consecutive groups start (and the end of the last one).
+
+
+def save_columns(path: Union[str, Path], columns: dict[str, np.ndarray]) -> None:
+    # Every save is written into a new versioned sibling directory, and `path` is a symlink which is then swapped
+    # to it atomically, so that readers always see a complete version. Files which other processes may have
+    # memory-mapped are never truncated, only unlinked along with the version they belong to.
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = uuid.uuid4().hex[:8]
+    version_path = path.parent / f".{path.name}.v-{suffix}"
+    old_version_path = path.resolve() if path.is_symlink() else None
+    version_path.mkdir()
+    try:
+        for name, column in columns.items():
+            np.save(version_path / f"{name}.npy", np.ascontiguousarray(column), allow_pickle=False)
+        link_path = path.parent / f".{path.name}.link-{suffix}"
+        os.symlink(version_path.name, link_path)
+        os.replace(link_path, path)
+    except BaseException:
+        shutil.rmtree(version_path, ignore_errors=True)
+        raise
+    if old_version_path is not None:
+        # moved away first, so that readers which have resolved the old version fail to open it as a whole
+        trash_path = path.parent / f".{path.name}.old-{suffix}"
+        try:
+            old_version_path.rename(trash_path)
+        except FileNotFoundError:
+            return  # removed by a concurrent save
+        shutil.rmtree(trash_path)
+
+def load_columns(path: Union[str, Path]) -> dict[str, np.ndarray]:
+    path = Path(path)
+    if not path.is_dir():
+        raise ValueError(f"The given intermediate '{path}' doesn't exist")
+    while True:
+        version_path = path.resolve()
+        try:
+            columns = {Path(name).stem: np.load(version_path / name, mmap_mode="r", allow_pickle=False)
+                       for name in os.listdir(version_path) if name.endswith(".npy")}
+        except FileNotFoundError:
+            continue  # replaced by a concurrent save in the meantime, the link points to a complete version again
+        # a version is moved away before being removed, so if it's still there, none of its columns has been missed
+        if version_path.exists():
+            return columns
+
+def _to_splits(group_lengths: list[int]) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(group_lengths, dtype=np.int64)]).astype(np.int64)
+
+def _notes_to_columns(notes: list[Note]) -> dict[str, np.ndarray]:
+    return {
+        "note_start": np.array([note.start for note in notes], dtype=np.float64),
+        "note_end": np.array([note.end for note in notes], dtype=np.float64),
+        "note_pitch": np.array([note.pitch for note in notes], dtype=np.int16),
+        "note_velocity": np.array([note.velocity for note in notes], dtype=np.int16),
+    }
+
+def _columns_to_notes(columns: dict[str, np.ndarray], begin: int, end: int) -> list[Note]:
+    return [Note(velocity, pitch, start, end)
+            for velocity, pitch, start, end in zip(columns["note_velocity"][begin:end].tolist(),
+                                                   columns["note_pitch"][begin:end].tolist(),
+                                                   columns["note_start"][begin:end].tolist(),
+                                                   columns["note_end"][begin:end].tolist())]
+
+def save_transcription(path: Union[str, Path], midi_by_stem: dict[str, PrettyMIDI]) -> None:
+    notes_by_stem = {stem: midi.instruments[0].notes for stem, midi in midi_by_stem.items()}
+    save_columns(path, {
+        **_notes_to_columns([note for notes in notes_by_stem.values() for note in notes]),
+        "stem": np.array(list(notes_by_stem), dtype=str),
+        "stem_splits": _to_splits([len(notes) for notes in notes_by_stem.values()]),
+    })
+
+def load_transcription(path: Union[str, Path]) -> dict[str, PrettyMIDI]:
+    columns = load_columns(path)
+    splits = columns["stem_splits"].tolist()
+    return {stem: midi_from_notes(_columns_to_notes(columns, begin, end))
+            for stem, begin, end in zip(columns["stem"].tolist(), splits, splits[1:])}
+
+def save_mono_voices(path: Union[str, Path], mono_midis_by_octave_by_stem: dict[str, dict[int, list[PrettyMIDI]]]) -> None:
+    # octaves are a group of their own, so that ones without any voices are kept too
+    octaves = [(stem_code, octave, mono_midis)
+               for stem_code, mono_midis_by_octave in enumerate(mono_midis_by_octave_by_stem.values())
+               for octave, mono_midis in mono_midis_by_octave.items()]
+    voices = [mono_midi.instruments[0].notes for _, _, mono_midis in octaves for mono_midi in mono_midis]
+    save_columns(path, {
+        **_notes_to_columns([note for notes in voices for note in notes]),
+        "stem": np.array(list(mono_midis_by_octave_by_stem), dtype=str),
+        "octave_stem": np.array([stem_code for stem_code, _, _ in octaves], dtype=np.int16),
+        "octave": np.array([octave for _, octave, _ in octaves], dtype=np.int16),
+        "octave_splits": _to_splits([len(mono_midis) for _, _, mono_midis in octaves]),
+        "voice_splits": _to_splits([len(notes) for notes in voices]),
+    })
+
+def load_mono_voices(path: Union[str, Path]) -> dict[str, dict[int, list[PrettyMIDI]]]:
+    columns = load_columns(path)
+    stems = columns["stem"].tolist()
+    octave_splits = columns["octave_splits"].tolist()
+    voice_splits = columns["voice_splits"].tolist()
+
+    mono_midis_by_octave_by_stem = {stem: {} for stem in stems}
+    for stem_code, octave, begin, end in zip(columns["octave_stem"].tolist(), columns["octave"].tolist(),
+                                             octave_splits, octave_splits[1:]):
+        mono_midis_by_octave_by_stem[stems[stem_code]][octave] = [
+            midi_from_notes(_columns_to_notes(columns, voice_splits[i], voice_splits[i + 1])) for i in range(begin, end)
+        ]
+    return mono_midis_by_octave_by_stem
+
+def save_ds_batches(path: Union[str, Path], ds_batches_and_offsets: list[tuple[dict[str, str], float]], end_s: float) -> None:
+    ds_batches = [ds_batch for ds_batch, _ in ds_batches_and_offsets]
+    phonemes_by_batch = [ds_batch["ph_seq"].split(" ") for ds_batch in ds_batches]
+    note_symbols_by_batch = [ds_batch["note_seq"].split(" ") for ds_batch in ds_batches]
+
+    phoneme_vocab, phoneme_codes = np.unique([p for phonemes in phonemes_by_batch for p in phonemes], return_inverse=True)
+    note_vocab, note_codes = np.unique([s for symbols in note_symbols_by_batch for s in symbols], return_inverse=True)
+    save_columns(path, {
+        "phoneme": phoneme_vocab.astype(str),
+        "phoneme_code": phoneme_codes.astype(np.int16),
+        "note_symbol": note_vocab.astype(str),
+        "note_code": note_codes.astype(np.int16),
+        "duration": np.array([float(d) for ds_batch in ds_batches for d in ds_batch["note_dur_seq"].split(" ")],
+                             dtype=np.float64),
+        "is_slur": np.array([int(s) for ds_batch in ds_batches for s in ds_batch["is_slur_seq"].split(" ")],
+                            dtype=np.uint8),
+        "batch_offset": np.array([offset for _, offset in ds_batches_and_offsets], dtype=np.float64),
+        "batch_splits": _to_splits([len(phonemes) for phonemes in phonemes_by_batch]),
+        "end": np.array(end_s, dtype=np.float64),
+    })
+
+def load_ds_batches(path: Union[str, Path]) -> tuple[list[tuple[dict[str, str], float]], float]:
+    columns = load_columns(path)
+    phoneme_vocab = columns["phoneme"].tolist()
+    note_vocab = columns["note_symbol"].tolist()
+    splits = columns["batch_splits"].tolist()
+
+    ds_batches_and_offsets = []
+    for offset, begin, end in zip(columns["batch_offset"].tolist(), splits, splits[1:]):
+        ds_batch = {
+            "input_type": "phoneme",
+            "text": "",
+            "ph_seq": " ".join(phoneme_vocab[code] for code in columns["phoneme_code"][begin:end].tolist()),
+            "note_seq": " ".join(note_vocab[code] for code in columns["note_code"][begin:end].tolist()),
+            "note_dur_seq": " ".join(map(str, columns["duration"][begin:end].tolist())),
+            "is_slur_seq": " ".join(map(str, columns["is_slur"][begin:end].tolist())),
+        }
+        ds_batches_and_offsets.append((ds_batch, offset))
+    return ds_batches_and_offsets, columns["end"].item()
+
 """# Singing voice conversion (Fish Diffusion)"""
 
 # Commented out IPython magic to ensure Python compatibility.
@@ -450,90 +622,821 @@ def normalize_audio(
     ]
     subprocess.run(" ".join(ffmpeg_norm_cmd), shell=True, check=True)
 
+"""# Model management"""
+
+!pip install -q psutil
+
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+import ctypes
+import gc
+import sys
+import threading
+from typing import Any, Callable, Iterator, Optional
+
+import psutil
+
+
+def get_rss_bytes(include_self: bool = True, include_children: bool = True) -> int:
+    process = psutil.Process()
+    processes = ([process] if include_self else []) + (process.children(recursive=True) if include_children else [])
+    rss = 0
+    for p in processes:
+        try:
+            rss += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass  # the child has exited in the meantime
+    return rss
+
+def _release_freed_memory() -> None:
+    gc.collect()
+    if "torch" in sys.modules and sys.modules["torch"].cuda.is_available():
+        sys.modules["torch"].cuda.empty_cache()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)  # otherwise glibc keeps the freed memory and RSS doesn't drop
+    except (OSError, AttributeError):
+        pass
+
+class _SamplingThread(threading.Thread):
+    # Sampling memory reads /proc, which would otherwise be accounted as I/O of whatever is being measured
+    _lock = threading.Lock()
+    _finished_read_b = 0
+
+    def __init__(self, target: Callable[[], None]) -> None:
+        super().__init__(target=target, daemon=True)
+        self._finished = False
+
+    def run(self) -> None:
+        try:
+            super().run()
+        finally:
+            with _SamplingThread._lock:
+                _SamplingThread._finished_read_b += self.get_read_bytes()
+                self._finished = True
+
+    def get_read_bytes(self) -> int:
+        try:
+            with open(f"/proc/self/task/{self.native_id}/io") as f:
+                return next(int(line.split()[1]) for line in f if line.startswith("rchar:"))
+        except (OSError, StopIteration):
+            return 0  # e.g. not on Linux
+
+def get_sampling_read_bytes() -> int:
+    # bytes read so far by the memory sampling threads of this process, both running and finished ones
+    with _SamplingThread._lock:
+        return _SamplingThread._finished_read_b + sum(
+            thread.get_read_bytes() for thread in threading.enumerate()
+            if isinstance(thread, _SamplingThread) and not thread._finished
+        )
+
+
+class ModelManager:
+    def __init__(
+        self,
+        memory_budget_mb: Optional[float] = None,  # None -- all models stay resident, 0 -- one model at a time
+        sampling_interval_s: float = 0.05,
+    ) -> None:
+        self.memory_budget_mb = memory_budget_mb
+        self.sampling_interval_s = sampling_interval_s
+        self._loaders: dict[str, Callable[[], Any]] = {}
+        self._resident: OrderedDict[str, Any] = OrderedDict()  # least recently used first
+        self._footprints_b: dict[str, int] = {}
+        # of subprocesses, which only take memory while the model is being used
+        self._subprocess_footprints_b: dict[str, int] = {}
+        self._loads: dict[str, int] = defaultdict(int)
+        self._evictions: dict[str, int] = defaultdict(int)
+        self._peak_rss_by_stage_b: dict[str, int] = {}
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        subprocess_footprint_mb: Optional[float] = None,  # learned in `using` otherwise
+    ) -> None:
+        if name in self._loaders:
+            raise ValueError(f"Model '{name}' is already registered")
+        self._loaders[name] = loader
+        if subprocess_footprint_mb is not None:
+            self._subprocess_footprints_b[name] = int(subprocess_footprint_mb * 2 ** 20)
+
+    def get(self, name: str) -> Any:
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: '{name}'")
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return self._resident[name]
+
+        # the footprint is unknown before the first load, hence room is made again after loading
+        self._make_room(self._footprints_b.get(name, 0))
+        rss_before_b = get_rss_bytes(include_children=False)
+        model = self._loaders[name]()
+        self._footprints_b[name] = max(0, get_rss_bytes(include_children=False) - rss_before_b)
+        self._resident[name] = model
+        self._loads[name] += 1
+        print(f"Loaded model '{name}' ({self._footprints_b[name] / 2 ** 20:.1f} MB)")
+        self._make_room(0, keep=name)
+        return model
+
+    def evict(self, name: str) -> None:
+        if name not in self._resident:
+            return
+        del self._resident[name]
+        self._evictions[name] += 1
+        _release_freed_memory()
+        print(f"Evicted model '{name}'")
+
+    @contextmanager
+    def using(self, name: str) -> Iterator[Any]:
+        # For models running in subprocesses, whose memory isn't visible when loading them. Room is made for
+        # the subprocesses' footprint only for the duration of the block; it's learned from the children's peak RSS.
+        model = self.get(name)
+        self._make_room(self._subprocess_footprints_b.get(name, 0), keep=name)
+        with self._sampling_peak(lambda: get_rss_bytes(include_self=False)) as get_peak_children_rss_b:
+            yield model
+        if get_peak_children_rss_b() > self._subprocess_footprints_b.get(name, 0):
+            self._subprocess_footprints_b[name] = get_peak_children_rss_b()
+            print(f"Learned subprocess footprint of model '{name}' "
+                  f"({self._subprocess_footprints_b[name] / 2 ** 20:.1f} MB)")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        with self._sampling_peak(get_rss_bytes) as get_peak_rss_b:
+            yield
+        self._peak_rss_by_stage_b[name] = max(self._peak_rss_by_stage_b.get(name, 0), get_peak_rss_b())
+
+    def report(self) -> dict[str, Any]:
+        def to_mb(size_b: int) -> float:
+            return round(size_b / 2 ** 20, 1)
+
+        return {
+            "peak_rss_mb_by_stage": {stage: to_mb(b) for stage, b in self._peak_rss_by_stage_b.items()},
+            "footprint_mb_by_model": {name: to_mb(b) for name, b in self._footprints_b.items()},
+            "subprocess_footprint_mb_by_model": {name: to_mb(b) for name, b in self._subprocess_footprints_b.items()},
+            "loads_by_model": dict(self._loads),
+            "evictions_by_model": dict(self._evictions),
+            "resident_models": list(self._resident),
+        }
+
+    @contextmanager
+    def _sampling_peak(self, measure_b: Callable[[], int]) -> Iterator[Callable[[], int]]:
+        peak_b = measure_b()
+        done = threading.Event()
+
+        def sample() -> None:
+            nonlocal peak_b
+            while not done.wait(self.sampling_interval_s):
+                peak_b = max(peak_b, measure_b())
+
+        sampler = _SamplingThread(target=sample)
+        sampler.start()
+        try:
+            yield lambda: peak_b
+        finally:
+            done.set()
+            sampler.join()
+            peak_b = max(peak_b, measure_b())
+
+    def _make_room(self, needed_b: int, keep: Optional[str] = None) -> None:
+        if self.memory_budget_mb is None:
+            return
+        budget_b = self.memory_budget_mb * 2 ** 20
+        while sum(self._footprints_b[name] for name in self._resident) + needed_b > budget_b:
+            evictable = [name for name in self._resident if name != keep]
+            if len(evictable) == 0:
+                break
+            self.evict(evictable[0])
+
+"""# Work queue"""
+
+!pip install -q pydub
+
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+import json
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Any, Iterator, Optional, Union
+import uuid
+
+from pydub import AudioSegment
+
+
+@dataclass
+class SegmentJob:
+    job_id: str
+    index: int  # position of the segment in the song
+    audio_path: str  # relative to the queue's root, so that it's valid on every node
+    start_ms: int
+    end_ms: int
+    settings: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class SegmentResult:
+    job_id: str
+    index: int
+    worker: str
+    mix_path: Optional[str] = None  # relative to the queue's root
+    error: Optional[str] = None
+
+
+class FileWorkQueue:
+    # The root can be a directory shared between nodes (e.g. over NFS) or just a local one, with workers
+    # being other processes on the same machine. Jobs are claimed by atomically renaming their files.
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(root)
+        for subdir in ("audio", "pending", "claimed", "results"):
+            (self.root / subdir).mkdir(parents=True, exist_ok=True)
+
+    def path(self, relative_path: str) -> Path:
+        return self.root / relative_path
+
+    def store_audio(self, job_id: str, audio: AudioSegment) -> str:
+        relative_path = self._audio_path(job_id)
+        audio.export(self.path(relative_path), format="wav")
+        return relative_path
+
+    def store_result_audio(self, job_id: str, audio_path: Path) -> str:
+        relative_path = f"results/{job_id}.wav"
+        tmp_path = self._tmp_path(self.path(relative_path))
+        shutil.copyfile(audio_path, tmp_path)
+        os.replace(tmp_path, self.path(relative_path))
+        return relative_path
+
+    def publish(self, job: SegmentJob) -> None:
+        self._write_json(self.root / "pending" / f"{job.job_id}.json", asdict(job))
+
+    def claim(self) -> Optional[SegmentJob]:
+        for job_path in sorted((self.root / "pending").glob("*.json")):
+            claimed_path = self.root / "claimed" / job_path.name
+            try:
+                os.utime(job_path)  # start of the lease, the rename keeps the mtime
+                os.rename(job_path, claimed_path)
+                job = SegmentJob(**json.loads(claimed_path.read_text()))
+            except FileNotFoundError:
+                continue  # claimed by another worker or discarded in the meantime
+            if not self.path(job.audio_path).exists():
+                claimed_path.unlink(missing_ok=True)  # the job has been discarded, nobody will collect its result
+                continue
+            return job
+        return None
+
+    @contextmanager
+    def renewing_lease(self, job_id: str, interval_s: float) -> Iterator[None]:
+        claimed_path = self.root / "claimed" / f"{job_id}.json"
+        done = threading.Event()
+
+        def renew() -> None:
+            while not done.wait(interval_s):
+                try:
+                    os.utime(claimed_path)
+                except FileNotFoundError:
+                    return  # requeued or discarded in the meantime
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            done.set()
+            renewer.join()
+
+    def complete(self, result: SegmentResult) -> None:
+        self._write_json(self.root / "results" / f"{result.job_id}.json", asdict(result))
+        (self.root / "claimed" / f"{result.job_id}.json").unlink(missing_ok=True)
+        if not self.path(self._audio_path(result.job_id)).exists():
+            self.discard(result.job_id)  # discarded while being processed, the result would never be collected
+
+    def collect(self, job_id: str) -> Optional[SegmentResult]:
+        result_path = self.root / "results" / f"{job_id}.json"
+        if not result_path.exists():
+            return None
+        return SegmentResult(**json.loads(result_path.read_text()))
+
+    def requeue_stale(self, lease_s: float) -> None:
+        # jobs of workers which have died are given to other workers
+        for claimed_path in (self.root / "claimed").glob("*.json"):
+            try:
+                if time.time() - claimed_path.stat().st_mtime > lease_s:
+                    os.rename(claimed_path, self.root / "pending" / claimed_path.name)
+                    print(f"Requeued stale job '{claimed_path.stem}'")
+            except FileNotFoundError:
+                pass  # completed in the meantime
+
+    def discard(self, job_id: str) -> None:
+        # the audio goes first, as its absence is what tells workers that the job has been discarded
+        for relative_path in (self._audio_path(job_id), f"pending/{job_id}.json", f"claimed/{job_id}.json",
+                              f"results/{job_id}.json", f"results/{job_id}.wav"):
+            self.path(relative_path).unlink(missing_ok=True)
+
+    def _audio_path(self, job_id: str) -> str:
+        return f"audio/{job_id}.wav"
+
+    def _write_json(self, path: Path, obj: dict[str, Any]) -> None:
+        tmp_path = self._tmp_path(path)
+        tmp_path.write_text(json.dumps(obj))
+        os.replace(tmp_path, path)
+
+    def _tmp_path(self, path: Path) -> Path:
+        # files are written under a temporary name first, so that readers never see a partially written one;
+        # the name is unique, as a requeued job can be completed by two workers at the same time
+        return path.parent / f".{path.name}.{uuid.uuid4().hex}.tmp"
+
+"""# Workspace"""
+
+from contextlib import contextmanager
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import socket
+from tempfile import mkdtemp
+import time
+from typing import Any, Iterator, Optional, Union
+import uuid
+
+import psutil
+
+
+def get_size_bytes(path: Path) -> int:
+    # files removed in the meantime, e.g. by other processes, are skipped
+    if not path.is_dir():
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+    size_b = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                size_b += os.stat(os.path.join(dir_path, file_name)).st_size
+            except FileNotFoundError:
+                pass
+    return size_b
+
+def get_file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(2 ** 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _get_io_bytes() -> tuple[int, int]:
+    # bytes read and written by this process and its children, page cache hits included, but not the reads of
+    # /proc by the memory sampling threads; the kernel adds the counters of finished children to the parent's
+    # once they're reaped
+    process = psutil.Process()
+    read_b, written_b = -get_sampling_read_bytes(), 0  # taken first, so that the difference can't go negative
+    for p in [process] + process.children(recursive=True):
+        try:
+            io_counters = p.io_counters()
+        except psutil.NoSuchProcess:
+            continue  # the child has exited in the meantime
+        read_b += io_counters.read_chars
+        written_b += io_counters.write_chars
+    return read_b, written_b
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)  # e.g. on another filesystem
+
+
+class Workspace:
+    # Every job gets its own scratch directory, which is removed with everything in it once the job is done.
+    # Artifacts worth reusing across jobs are kept in the cache, whose size is bounded by the quota; whole cache
+    # entries are evicted, least recently used first. The cache may be shared by many processes, so entries
+    # appear and disappear atomically (by renaming) and jobs use hardlinked copies of them.
+
+    def __init__(
+        self,
+        root: Union[str, Path] = "workspace",
+        quota_mb: Optional[float] = 4096,  # None -- unbounded
+        stale_job_age_h: float = 24.0,
+    ) -> None:
+        self.root = Path(root)
+        self.quota_mb = quota_mb
+        self.stale_job_age_h = stale_job_age_h
+        self._io_bytes_by_stage: dict[str, dict[str, int]] = {}
+        self._evictions = 0
+        self._remove_stale_jobs()
+
+    @property
+    def jobs_dir(self) -> Path:
+        return self.root / "jobs"
+
+    @property
+    def cache_dir(self) -> Path:
+        return self.root / "cache"
+
+    @contextmanager
+    def job(self) -> Iterator[Path]:
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        # the owner is encoded in the name, so that directories of killed processes can be recognized
+        job_dir = Path(mkdtemp(prefix=f"{os.getpid()}@{socket.gethostname()}@", dir=self.jobs_dir))
+        try:
+            yield job_dir
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self.enforce_quota()
+
+    def cached(self, namespace: str, key: str) -> Path:
+        # the entry itself is neither created nor checked for, it's up to the caller
+        path = self.cache_dir / namespace / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.utime(path)  # marks the entry as recently used
+        except FileNotFoundError:
+            pass
+        return path
+
+    def store(self, src_dir: Path, entry: Path) -> None:
+        tmp_path = entry.parent / f".{entry.name}.tmp-{uuid.uuid4().hex[:8]}"
+        shutil.copytree(src_dir, tmp_path, copy_function=_link_or_copy)
+        try:
+            os.rename(tmp_path, entry)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)  # stored by another job in the meantime
+
+    def restore(self, entry: Path, dest_dir: Path) -> bool:
+        # the job gets its own hardlinks, so that the entry can be evicted while the job still uses it
+        try:
+            shutil.copytree(entry, dest_dir, copy_function=_link_or_copy)
+        except (FileNotFoundError, shutil.Error):
+            shutil.rmtree(dest_dir, ignore_errors=True)  # not cached or evicted in the meantime
+            return False
+        return True
+
+    def enforce_quota(self) -> None:
+        if self.quota_mb is None:
+            return
+
+        last_used_s_and_size_b_by_entry = {}
+        for namespace_dir in self._list_dir(self.cache_dir):
+            for entry in self._list_dir(namespace_dir):
+                if entry.name.startswith("."):
+                    continue  # being stored or evicted
+                try:
+                    last_used_s_and_size_b_by_entry[entry] = (entry.stat().st_mtime, get_size_bytes(entry))
+                except FileNotFoundError:
+                    continue  # evicted by another process in the meantime
+
+        total_size_b = sum(size_b for _, size_b in last_used_s_and_size_b_by_entry.values())
+        for entry, (_, size_b) in sorted(last_used_s_and_size_b_by_entry.items(), key=lambda item: item[1][0]):
+            if total_size_b <= self.quota_mb * 2 ** 20:
+                break
+            total_size_b -= size_b
+            evicted_path = entry.parent / f".{entry.name}.evicted-{uuid.uuid4().hex[:8]}"
+            try:
+                os.rename(entry, evicted_path)
+            except FileNotFoundError:
+                continue  # evicted by another process in the meantime
+            if evicted_path.is_dir():
+                shutil.rmtree(evicted_path, ignore_errors=True)
+            else:
+                evicted_path.unlink(missing_ok=True)
+            self._evictions += 1
+            print(f"Evicted cached '{entry}'")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        read_before_b, written_before_b = _get_io_bytes()
+        try:
+            yield
+        finally:
+            read_after_b, written_after_b = _get_io_bytes()
+            io_bytes = self._io_bytes_by_stage.setdefault(name, {"read": 0, "written": 0})
+            io_bytes["read"] += read_after_b - read_before_b
+            io_bytes["written"] += written_after_b - written_before_b
+
+    def report(self) -> dict[str, Any]:
+        def to_mb(size_b: int) -> float:
+            return round(size_b / 2 ** 20, 1)
+
+        return {
+            "io_mb_by_stage": {stage: {kind: to_mb(b) for kind, b in io_bytes.items()}
+                               for stage, io_bytes in self._io_bytes_by_stage.items()},
+            "cache_mb": to_mb(get_size_bytes(self.cache_dir)),
+            "cache_evictions": self._evictions,
+        }
+
+    def _remove_stale_jobs(self) -> None:
+        # directories of jobs whose processes have been killed (e.g. by the OOM killer) aren't removed by `job`
+        hostname = socket.gethostname()
+        for job_dir in self._list_dir(self.jobs_dir):
+            pid, _, rest = job_dir.name.partition("@")
+            host = rest.partition("@")[0]
+            try:
+                is_owner_dead = host == hostname and pid.isdigit() and not psutil.pid_exists(int(pid))
+                is_old = time.time() - job_dir.stat().st_mtime > self.stale_job_age_h * 3600
+            except FileNotFoundError:
+                continue  # removed by another process in the meantime
+            if is_owner_dead or is_old:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                print(f"Removed stale job directory '{job_dir}'")
+
+    def _list_dir(self, path: Path) -> list[Path]:
+        try:
+            return list(path.iterdir())
+        except FileNotFoundError:
+            return []
+
 """# Acappellifier"""
 
 !pip install -q pydub pretty_midi
 
 from collections import defaultdict
+from contextlib import contextmanager
 from itertools import chain
+import os
 from pathlib import Path
 import pprint
+import shutil
+import socket
 import subprocess
-from tempfile import NamedTemporaryFile
-from typing import Union
+import time
+from typing import Iterable, Iterator, Optional, Union
+import uuid
 
 from pretty_midi import PrettyMIDI
 from pydub import AudioSegment
+from pydub.utils import mediainfo
 
 
 DIFFSINGER_FRIENDLY_OCTAVE = 4
 
 
 class Acappellifier:
-    def __init__(
-        self,
-        demucs: Demucs,
-        basic_pitch: BasicPitch,
-        diff_singer: DiffSinger,
-        hifi_singer_svc: HiFiSingerSVCInference,
-    ) -> None:
-        self.demucs = demucs
-        self.basic_pitch = basic_pitch
-        self.diff_singer = diff_singer
-        self.hifi_singer_svc = hifi_singer_svc
+    FIRST_SEGMENT_LENGTH_MS = int(10.5 * 1000)
+    SUBSEQUENT_SEGMENT_LENGTH_MS = 11 * 1000
+    LAST_SEGMENT_MIN_LENGTH_MS = 4 * 1000
+    SEGMENT_OVERLAP_MS = 1000  # the overlapping parts of consecutive output segments are crossfaded
+    TRANSCRIBED_STEMS = ["other", "bass"]
+
+    def __init__(self, models: ModelManager, workspace: Optional[Workspace] = None) -> None:
+        # expects "demucs", "basic_pitch", "diff_singer" and "hifi_singer_svc" to be registered
+        self.models = models
+        self.workspace = workspace if workspace is not None else Workspace()
+        self.stream_report: dict[str, Optional[float]] = {}  # of the latest `acappellify_stream`
+
+    @property
+    def demucs(self) -> Demucs:
+        return self.models.get("demucs")
+
+    @property
+    def basic_pitch(self) -> BasicPitch:
+        return self.models.get("basic_pitch")
+
+    @property
+    def diff_singer(self) -> DiffSinger:
+        return self.models.get("diff_singer")
+
+    @property
+    def hifi_singer_svc(self) -> HiFiSingerSVCInference:
+        return self.models.get("hifi_singer_svc")
 
     def acappellify(self, song_path: Union[str, Path]) -> Path:
         song_path = Path(song_path)
 
-        acappella_segment_paths = []
-        for segment in self._slice_input(AudioSegment.from_file(song_path)):
-            with NamedTemporaryFile(delete=False, suffix=".wav") as tmpf:
-                segment.export(tmpf.name, format="wav")
-                acappella_segment_path = self._acappellify_single(Path(tmpf.name))
+        with self.workspace.job() as job_dir:
+            acappella_segment_paths = []
+            for i, segment in enumerate(self._slice_input(AudioSegment.from_file(song_path))):
+                segment_path = job_dir / f"segment{i}.wav"
+                segment.export(segment_path, format="wav")
+                acappella_segment_path = self._acappellify_single(segment_path, job_dir / segment_path.stem)
                 acappella_segment_paths.append(acappella_segment_path)
 
-        if len(acappella_segment_paths) == 0:
-            raise RuntimeError(f"No acappella segments produced for '{song_path}'")
+            if len(acappella_segment_paths) == 0:
+                raise RuntimeError(f"No acappella segments produced for '{song_path}'")
+
+            print(f"Acapella segment paths: {acappella_segment_paths}")
+
+            acappella_path = self._concatenate(song_path, list(map(AudioSegment.from_file, acappella_segment_paths)))
+
+        self._print_reports()
+        return acappella_path
+
+    def acappellify_stream(
+        self,
+        song: Union[str, Path, Iterable[AudioSegment]],  # a path (or e.g. "pipe:0") to decode, or a stream of chunks
+        chunk_ms: int = 1000,
+    ) -> Iterator[AudioSegment]:
+        if chunk_ms <= 0:
+            raise ValueError(f"Chunk length must be positive, got {chunk_ms} ms")
+
+        start_time_s = time.perf_counter()
+        chunks = self._read_chunks(Path(song), chunk_ms) if isinstance(song, (str, Path)) else song
+
+        self.stream_report = {"time_to_first_chunk_s": None, "real_time_factor": None}
+        steady_processing_time_s = 0.0
+        steady_output_ms = 0
+        tail = None  # held back until it's crossfaded with the beginning of the next output segment
+        with self.workspace.job() as job_dir:
+            for i, segment in enumerate(self._iter_slices(chunks)):
+                if len(segment) == 0:  # only possible when the whole input is empty
+                    raise RuntimeError("The given input contains no audio")
+
+                segment_start_time_s = time.perf_counter()
+                segment_path = job_dir / f"segment{i}.wav"
+                segment.export(segment_path, format="wav")
+                acappella_segment = AudioSegment.from_file(self._acappellify_single(segment_path, job_dir / segment_path.stem))
+                # already loaded, so the files don't need to pile up until the end of the stream
+                segment_path.unlink()
+                shutil.rmtree(job_dir / segment_path.stem)
+
+                if tail is not None:
+                    acappella_segment = tail.append(acappella_segment, crossfade=self.SEGMENT_OVERLAP_MS)
+                # a segment can be shorter than the overlap when the whole input is
+                held_back_ms = min(len(acappella_segment), self.SEGMENT_OVERLAP_MS)
+                ready = acappella_segment[:len(acappella_segment) - held_back_ms]
+                tail = acappella_segment[len(acappella_segment) - held_back_ms:]
+
+                if i == 0:
+                    self.stream_report["time_to_first_chunk_s"] = round(time.perf_counter() - start_time_s, 3)
+                else:
+                    steady_processing_time_s += time.perf_counter() - segment_start_time_s
+                    steady_output_ms += len(ready)
+                yield ready
+
+        yield tail
+
+        if steady_output_ms > 0:
+            steady_output_ms += len(tail)
+            self.stream_report["real_time_factor"] = round(steady_processing_time_s / (steady_output_ms / 1000), 3)
+        print("Streaming report:")
+        pprint.pprint(self.stream_report)
+        self._print_reports()
+
+    def _read_chunks(
+        self,
+        song_path: Path,
+        chunk_ms: int,
+        sample_rate: int = 44100,  # for pipes, files are decoded at their own sample rate and channel count
+        channels: int = 2,
+    ) -> Iterator[AudioSegment]:
+        if song_path.is_file():
+            info = mediainfo(str(song_path))
+            sample_rate, channels = int(info["sample_rate"]), int(info["channels"])
+        sample_width = 2  # s16le
+        chunk_size = (sample_rate * chunk_ms // 1000) * channels * sample_width  # whole frames only
+        ffmpeg_decode_cmd = [
+            "ffmpeg", "-v", "error",
+            "-i", str(song_path),
+            "-f", "s16le",
+            "-ac", str(channels),
+            "-ar", str(sample_rate),
+            "-",
+        ]
+        with subprocess.Popen(ffmpeg_decode_cmd, stdout=subprocess.PIPE) as p:
+            while chunk := p.stdout.read(chunk_size):
+                yield AudioSegment(data=chunk, sample_width=sample_width, frame_rate=sample_rate, channels=channels)
+        if p.returncode != 0:
+            raise RuntimeError(f"Command failed: {' '.join(ffmpeg_decode_cmd)}")
 
-        print(f"Acapella segment paths: {acappella_segment_paths}")
+    def acappellify_distributed(
+        self,
+        song_path: Union[str, Path],
+        queue: FileWorkQueue,
+        timeout_s: float = 24 * 3600.0,
+        lease_s: float = 3600.0,  # after that long, a claimed job is assumed to be lost and is published again
+        poll_interval_s: float = 1.0,
+    ) -> Path:
+        song_path = Path(song_path)
+        run_id = f"{song_path.stem}-{uuid.uuid4().hex[:8]}"
 
-        # concatenation of output fragments
-        acappella_segments = list(map(AudioSegment.from_file, acappella_segment_paths))
+        # every job is discarded in the end, whether it has succeeded or not, so that nothing is left in the queue
+        # and workers don't process jobs of a failed run
+        job_ids = []
+        try:
+            jobs = []
+            start_ms = 0
+            for i, segment in enumerate(self._iter_slices([AudioSegment.from_file(song_path)])):
+                job_id = f"{run_id}-{i:04d}"
+                job_ids.append(job_id)
+                end_ms = start_ms + len(segment)
+                job = SegmentJob(job_id, i, queue.store_audio(job_id, segment), start_ms, end_ms,
+                                 settings={"stems": self.TRANSCRIBED_STEMS})
+                queue.publish(job)
+                jobs.append(job)
+                start_ms = end_ms - self.SEGMENT_OVERLAP_MS
+            print(f"Published {len(jobs)} segment jobs of run '{run_id}'")
+
+            results = {}
+            deadline_s = time.monotonic() + timeout_s
+            while True:
+                for job in jobs:
+                    if job.job_id not in results and (result := queue.collect(job.job_id)) is not None:
+                        results[job.job_id] = result
+                if len(results) == len(jobs):
+                    break
+                if time.monotonic() > deadline_s:
+                    raise TimeoutError(f"Only {len(results)} out of {len(jobs)} segment jobs completed for '{song_path}'")
+                queue.requeue_stale(lease_s)
+                time.sleep(poll_interval_s)
+
+            for job in jobs:
+                result = results[job.job_id]
+                if result.error is not None:
+                    raise RuntimeError(f"Segment job '{job.job_id}' failed on '{result.worker}': {result.error}")
+            acappella_segments = [AudioSegment.from_file(queue.path(results[job.job_id].mix_path)) for job in jobs]
+        finally:
+            for job_id in job_ids:
+                queue.discard(job_id)
+
+        return self._concatenate(song_path, acappella_segments)
+
+    def serve_segment_jobs(
+        self,
+        queue: FileWorkQueue,
+        idle_timeout_s: Optional[float] = None,  # None -- serve forever
+        poll_interval_s: float = 1.0,
+        lease_renewal_interval_s: float = 60.0,  # has to be well below the coordinator's `lease_s`
+    ) -> int:
+        worker = f"{socket.gethostname()}-{os.getpid()}"
+        served = 0
+        idle_since_s = time.monotonic()
+        while True:
+            job = queue.claim()
+            if job is None:
+                if idle_timeout_s is not None and time.monotonic() - idle_since_s > idle_timeout_s:
+                    return served
+                time.sleep(poll_interval_s)
+                continue
+
+            print(f"Worker '{worker}' processing segment job '{job.job_id}'")
+            with queue.renewing_lease(job.job_id, lease_renewal_interval_s), self.workspace.job() as job_dir:
+                try:
+                    mix_path = self._acappellify_single(queue.path(job.audio_path), job_dir, job.settings["stems"])
+                except Exception as e:
+                    queue.complete(SegmentResult(job.job_id, job.index, worker, error=repr(e)))
+                else:
+                    queue.complete(SegmentResult(job.job_id, job.index, worker,
+                                                 mix_path=queue.store_result_audio(job.job_id, mix_path)))
+            served += 1
+            idle_since_s = time.monotonic()
+
+    def _concatenate(self, song_path: Path, acappella_segments: list[AudioSegment]) -> Path:
         acappella = acappella_segments[0]
         for segment in acappella_segments[1:]:
-            acappella = acappella.append(segment, crossfade=1000)
+            acappella = acappella.append(segment, crossfade=self.SEGMENT_OVERLAP_MS)
 
         acappella_path = Path("acappellas") / f"{song_path.stem}_acappella.wav"
         acappella_path.parent.mkdir(parents=True, exist_ok=True)
         acappella.export(acappella_path, format="wav")
         return acappella_path
 
-    def _acappellify_single(self, song_path: Path) -> Path:
-        stems_dir = self._separate(Path(song_path), Path("separated"))
-        stems = ["other", "bass"]
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        with self.models.stage(name), self.workspace.stage(name):
+            yield
+
+    def _print_reports(self) -> None:
+        print("Model manager report:")
+        pprint.pprint(self.models.report())
+        print("Workspace report:")
+        pprint.pprint(self.workspace.report())
 
-        midi_by_stem = self._get_midi_for_stems(stems, stems_dir)
+    def _acappellify_single(self, song_path: Path, work_dir: Path, stems: Optional[list[str]] = None) -> Path:
+        with self._stage("separation"):
+            stems_dir = self._separate(Path(song_path), work_dir)
+        stems = stems if stems is not None else self.TRANSCRIBED_STEMS
+
+        with self._stage("transcription"):
+            midi_by_stem = self._get_midi_for_stems(stems, stems_dir)
         midi_by_octave_by_stem = {stem: split_into_octaves(midi) for stem, midi in midi_by_stem.items()}
         mono_midis_by_octave_by_stem = {stem: {octave: to_many_monophonic(midi) for octave, midi in midi_by_octave.items()}
                                         for stem, midi_by_octave in midi_by_octave_by_stem.items()}
 
-        vocal_paths_by_octave = self._vocalize_midis(mono_midis_by_octave_by_stem)
+        vocal_paths_by_octave = self._vocalize_midis(mono_midis_by_octave_by_stem, work_dir / "diffsinger_output")
 
         song_vocals_path = stems_dir / "vocals.wav"
-        return self._mix(song_vocals_path, vocal_paths_by_octave)
+        with self._stage("mixing"):
+            return self._mix(song_vocals_path, vocal_paths_by_octave, work_dir / "mix")
 
     def _vocalize_midis(
         self,
-        mono_midis_by_octave_by_stem: dict[str, dict[int, list[PrettyMIDI]]]
+        mono_midis_by_octave_by_stem: dict[str, dict[int, list[PrettyMIDI]]],
+        output_dir: Path,
     ) -> dict[int, list[Path]]:
-        output_dir = Path("diffsinger_output") / datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        # all synthesis is done before all conversion, so that only one of the models is needed at a time
+        vocal_paths_and_octaves = []
+        with self._stage("synthesis"):
+            for stem, mono_midis_by_octave in mono_midis_by_octave_by_stem.items():
+                for octave, mono_midis in mono_midis_by_octave.items():
+                    for i, mono_midi in enumerate(mono_midis):
+                        vocal_path = self._vocalize_mono_midi(mono_midi, octave, i, output_dir / stem)
+                        vocal_paths_and_octaves.append((vocal_path, octave))
 
         vocal_paths_by_octave = defaultdict(list)
-        for stem, mono_midis_by_octave in mono_midis_by_octave_by_stem.items():
-            for octave, mono_midis in mono_midis_by_octave.items():
-                for i, mono_midi in enumerate(mono_midis):
-                    vocal_path = self._vocalize_mono_midi(mono_midi, octave, i, output_dir / stem)
-                    vocal_paths_by_octave[octave].append(vocal_path)
+        with self._stage("conversion"):
+            for vocal_path, octave in vocal_paths_and_octaves:
+                transposed_vocal_path = self._transpose_vocal(vocal_path, DIFFSINGER_FRIENDLY_OCTAVE, octave)
+                vocal_paths_by_octave[octave].append(transposed_vocal_path)
 
         return vocal_paths_by_octave
 
@@ -546,9 +1449,7 @@ class Acappellifier:
         output_dir.mkdir(parents=True, exist_ok=True)
         vocal_path = output_dir / f"octave{octave}_mono{i}.wav"
         vocal_segment.export(vocal_path, format="wav")
-
-        transposed_vocal_path = self._transpose_vocal(vocal_path, DIFFSINGER_FRIENDLY_OCTAVE, octave)
-        return transposed_vocal_path
+        return vocal_path
 
     def _transpose_vocal(self, vocal_path: Path, current_octave: int, target_octave: int) -> Path:
         semitones_diff = 12 * (target_octave - current_octave)
@@ -556,8 +1457,9 @@ class Acappellifier:
         stem_suffix = f"transposed{'+' if semitones_diff >= 0 else '-'}{abs(semitones_diff)}"
         transposed_vocal_path = vocal_path.parent / f"{vocal_path.stem}_{stem_suffix}.wav"
 
+        hifi_singer_svc = self.hifi_singer_svc  # loaded outside of the `try` so that loading errors aren't swallowed
         try:
-            self.hifi_singer_svc.inference(
+            hifi_singer_svc.inference(
                 input_path=str(vocal_path),
                 output_path=str(transposed_vocal_path),
                 speaker=get_speaker_for_octave(target_octave),
@@ -571,10 +1473,15 @@ class Acappellifier:
         else:
             return transposed_vocal_path
 
-    def _separate(self, song_path: Path, output_dir: Path) -> Path:
-        stems_dir = output_dir / self.demucs.model / song_path.stem
-        if not stems_dir.exists():
-            return self.demucs.separate(song_path, output_dir)
+    def _separate(self, song_path: Path, work_dir: Path) -> Path:
+        # the stems are cached by the content of the input, so that the same audio is never separated twice
+        stems_dir = work_dir / "stems"
+        cached_stems_dir = self.workspace.cached("separated", f"{self.demucs.model}-{get_file_digest(song_path)}")
+        if not self.workspace.restore(cached_stems_dir, stems_dir):
+            with self.models.using("demucs") as demucs:
+                separated_dir = demucs.separate(song_path, work_dir / "separated")
+            os.rename(separated_dir, stems_dir)
+            self.workspace.store(stems_dir, cached_stems_dir)
         return stems_dir
 
     def _get_midi_for_stems(self, stems: list[str], stems_dir: Path) -> dict[str, PrettyMIDI]:
@@ -597,7 +1504,8 @@ class Acappellifier:
     def _mix(
         self,
         song_vocals_path: Path,
-        vocal_paths_by_octave: dict[int, list[Path]]
+        vocal_paths_by_octave: dict[int, list[Path]],
+        output_dir: Path,
     ) -> Path:
         def get_volume_adjustment_db(octave: int) -> int:
             if octave >= 3:
@@ -607,7 +1515,6 @@ class Acappellifier:
             else:
                 return -9
 
-        output_dir = Path("mixes") / datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         output_dir.mkdir(parents=True, exist_ok=True)
         output_path = output_dir / "mix.wav"
 
@@ -637,49 +1544,40 @@ class Acappellifier:
 
         filter_complex = f"\"{volume_filters};{amix_inputs}amix=inputs={len(audio_paths)}:duration=longest:dropout_transition=2\""
 
-        with NamedTemporaryFile(delete=False, suffix=".wav") as tmpf:
-            ffmpeg_mix_cmd = [
-                "ffmpeg -y",
-                input_args,
-                "-filter_complex",
-                filter_complex,
-                "-ac 2",
-                "-ar 44100",
-                "-f wav",
-                tmpf.name,
-            ]
-            subprocess.run(" ".join(ffmpeg_mix_cmd), shell=True, check=True)
-            normalize_audio(tmpf.name, output_path)
+        unnormalized_path = output_path.parent / f"{output_path.stem}_unnormalized.wav"
+        ffmpeg_mix_cmd = [
+            "ffmpeg -y",
+            input_args,
+            "-filter_complex",
+            filter_complex,
+            "-ac 2",
+            "-ar 44100",
+            "-f wav",
+            str(unnormalized_path.absolute()),
+        ]
+        subprocess.run(" ".join(ffmpeg_mix_cmd), shell=True, check=True)
+        normalize_audio(unnormalized_path, output_path)
+        unnormalized_path.unlink()
 
     def _slice_input(self, audio: AudioSegment) -> list[AudioSegment]:
-        def get_segment_end(
-            potential_end_ms: int,
-            total_length_ms: int,
-            last_segment_min_length_ms: int
-        ) -> int:
-            end = min(potential_end_ms, total_length_ms)
-            if total_length_ms - end < last_segment_min_length_ms:
-                end = total_length_ms
-            return end
-
-        total_length_ms = len(audio)
-        first_segment_length_ms = int(10.5 * 1000)
-        subsequent_segment_length_ms = 11 * 1000
-        last_segment_min_length_ms = 4 * 1000
-        overlap_ms = 1000
-
-        segments = []
-
-        end = get_segment_end(first_segment_length_ms, total_length_ms, last_segment_min_length_ms)
-        segments.append(audio[:end])
-        last_end = end
-        while last_end < total_length_ms:
-            start = max(0, last_end - overlap_ms)
-            end = get_segment_end(start + subsequent_segment_length_ms, total_length_ms, last_segment_min_length_ms)
-            segments.append(audio[start:end])
-            last_end = end
-
-        return segments
+        return list(self._iter_slices([audio]))
+
+    def _iter_slices(self, chunks: Iterable[AudioSegment]) -> Iterator[AudioSegment]:
+        # a segment is emitted once it's known not to be the last one, i.e. when enough audio follows it
+        buffer = AudioSegment.empty()
+        buffer_start = 0  # position of the buffer's beginning in the whole input
+        start, potential_end = 0, self.FIRST_SEGMENT_LENGTH_MS
+        for chunk in chunks:
+            buffer += chunk
+            while buffer_start + len(buffer) >= potential_end + self.LAST_SEGMENT_MIN_LENGTH_MS:
+                yield buffer[start - buffer_start:potential_end - buffer_start]
+                start = potential_end - self.SEGMENT_OVERLAP_MS
+                buffer = buffer[start - buffer_start:]
+                buffer_start = start
+                potential_end = start + self.SUBSEQUENT_SEGMENT_LENGTH_MS
+
+        # the remaining audio is too short to be split any further
+        yield buffer[start - buffer_start:]
 
 """# Experiments"""
 
@@ -687,7 +1585,7 @@ class Acappellifier:
 
 from pathlib import Path
 import subprocess
-from typing import Union
+from typing import Optional, Union
 
 from google.colab import files
 from pydub import AudioSegment
@@ -700,12 +1598,20 @@ def upload_file() -> Union[Path, None]:
     else:
         return None
 
-def crop_audio(audio_path: Union[str, Path], *, start_time_s: int, duration_s: int) -> Path:
+def crop_audio(
+    audio_path: Union[str, Path],
+    *,
+    start_time_s: int,
+    duration_s: int,
+    output_dir: Optional[Union[str, Path]] = None,  # defaults to the input's directory
+) -> Path:
     audio_path = Path(audio_path)
     if not audio_path.exists():
         raise ValueError(f"The given file '{audio_path}' doesn't exist")
 
-    output_path = audio_path.parent / f"{audio_path.stem}_ss{start_time_s}_t{duration_s}{audio_path.suffix}"
+    output_dir = Path(output_dir) if output_dir is not None else audio_path.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"{audio_path.stem}_ss{start_time_s}_t{duration_s}{audio_path.suffix}"
 
     ffmpeg_cmd = [
         "ffmpeg -y",
@@ -723,22 +1629,30 @@ import torch
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-demucs = Demucs()
-basic_pitch = BasicPitch()
-diff_singer = DiffSinger()
-hifi_singer_svc = HiFiSingerSVCInference(
-    Config.fromfile("configs/M4Singer.py"),
-    "checkpoints/M4Singer.ckpt"
-).to(device)
 
-acappellifier = Acappellifier(demucs, basic_pitch, diff_singer, hifi_singer_svc)
+def create_models(memory_budget_mb: Optional[float] = None) -> ModelManager:
+    # None -- all models resident (throughput), 0 -- one at a time (density)
+    models = ModelManager(memory_budget_mb)
+    models.register("demucs", Demucs)  # runs in a subprocess, its footprint is learned during the first separation
+    models.register("basic_pitch", BasicPitch)
+    models.register("diff_singer", DiffSinger)
+    models.register("hifi_singer_svc", lambda: HiFiSingerSVCInference(
+        Config.fromfile("configs/M4Singer.py"),
+        "checkpoints/M4Singer.ckpt"
+    ).to(device))
+    return models
+
+models = create_models(memory_budget_mb=None)
+
+workspace = Workspace(quota_mb=4096)  # bounds the disk usage of the cache, e.g. of the separated stems (None -- unbounded)
+acappellifier = Acappellifier(models, workspace)
 
 song_path = upload_file()  # or just a path if the file already exists
 
 assert song_path is not None, "Please, upload a song first"
 
 # NOTE: optionally crop the audio so that the processing doesn't take too long
-song_path = crop_audio(song_path, start_time_s=15, duration_s=10)
+song_path = crop_audio(song_path, start_time_s=15, duration_s=10, output_dir=workspace.root / "inputs")  # not in the cache, never evicted
 
 # original song
 AudioSegment.from_file(song_path)
@@ -748,4 +1662,42 @@ AudioSegment.from_file(song_path)
 # arrangement_path = acappellifier.acappellify(song_path)  # NOTE: first run always takes longer due to lazy imports taking place and models being downloaded
 # AudioSegment.from_file(arrangement_path)
 
-files.download(arrangement_path)
\ No newline at end of file
+files.download(arrangement_path)
+
+# distributed processing, with local worker processes standing in for other nodes sharing the queue's root
+# NOTE: workers are forked, so run this before any model has been put on the GPU (e.g. right after a restart)
+import multiprocessing
+
+NUM_WORKERS = 2
+
+def serve_segment_jobs(queue: FileWorkQueue) -> None:
+    # every worker loads its own models, the workspace's cache is shared between them
+    Acappellifier(create_models(memory_budget_mb=None), workspace).serve_segment_jobs(queue)
+
+queue = FileWorkQueue("queue")
+workers = [multiprocessing.get_context("fork").Process(target=serve_segment_jobs, args=(queue,), daemon=True)
+           for _ in range(NUM_WORKERS)]
+for worker in workers:
+    worker.start()
+try:
+    arrangement_path = acappellifier.acappellify_distributed(song_path, queue)
+finally:
+    for worker in workers:
+        worker.terminate()  # the queue is left empty, so nothing is lost
+        worker.join()
+AudioSegment.from_file(arrangement_path)
+
+# intermediates, e.g. the mono voices of the song, saved once and reloaded without running the models again
+import numpy as np
+
+midi = models.get("basic_pitch").get_midi(song_path)
+save_mono_voices("intermediates/mono_voices", {
+    "song": {octave: to_many_monophonic(octave_midi) for octave, octave_midi in split_into_octaves(midi).items()}
+})
+
+# the columns are just memory-mapped, e.g. for statistics which don't need any MIDI to be built
+columns = load_columns("intermediates/mono_voices")
+print(f"Notes per voice: {np.diff(columns['voice_splits']).tolist()}")
+print(f"Voices per octave: {dict(zip(columns['octave'].tolist(), np.diff(columns['octave_splits']).tolist()))}")
+
+mono_midis_by_octave = load_mono_voices("intermediates/mono_voices")["song"]
\ No newline at end of file